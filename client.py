@@ -1,15 +1,19 @@
+import sys
+
 import connect4
 # Client implementation of the human to computer connect4 game
 
 # utility method to print the board
 
 
-def print_board(board):
-    board.reverse()
-    for _ in board:
-        print(_)
-    print("\n")
+def print_board(board, symbols):
+    # top row first, written in one call without modifying the board
+    sys.stdout.write("\n".join("".join(symbols.get(cell, ".") for cell in row)
+                               for row in reversed(board)) + "\n\n\n")
+
 
+# column inputs accepted from the human player
+VALID_COLUMNS = frozenset("0123456")
 
 # variable to keep the loop
 isGameEnd = False
@@ -24,18 +28,22 @@ while (not isGameEnd):
         # start the game
         connect4.start_game()
         print("game start")
+        # one character per player for printing the board
+        symbols = dict(zip(connect4.get_player_names(), "XO"))
+        for player, symbol in symbols.items():
+            print(symbol + ":", player)
 
         while(not connect4.is_game_over()):
             if connect4.is_current_player_computer():
                 print("Computer places a checker")
                 board = connect4.place_token()
                 # print board
-                print_board(board)
+                print_board(board, symbols)
             else:
                 print(connect4.get_current_player(),
                       "please select a column to place checker:")
                 s = input()
-                while not s.isnumeric():
+                while s not in VALID_COLUMNS:
                     print("Please enter a valid number(0~6):")
                     s = input()
                 col = int(s)
@@ -44,7 +52,7 @@ while (not isGameEnd):
                     # place a move
                     board = connect4.place_token(col)
                     # prepare board to be printed
-                    print_board(board)
+                    print_board(board, symbols)
                 else:
                     # print error message for invalid column
                     print("Invalid Column!!\n")
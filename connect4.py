@@ -3,9 +3,54 @@
 @author Marci McBride (marcim)
 Connect4 API
 """
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Tuple
 import random
-import copy
+import time
+
+# Transposition table entry flags
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# Heuristic value of an open line by the number of tokens a player has in it
+LINE_WEIGHTS = (0, 1, 4, 16)
+
+COLUMNS = 7
+ROWS = 6
+
+def _winning_lines(rows: int, columns: int) -> Tuple[Tuple[int, ...], ...]:
+  """Precompute the winning lines passing through each cell.
+
+  Each line is stored as a bitboard mask of its four cells, so a player holds
+  the line exactly when `bitboard & mask == mask`.
+
+  Args:
+    rows: The number of rows on the board.
+    columns: The number of columns on the board.
+
+  Returns:
+    tuple: The masks of every line of four containing each cell, indexed by the
+    cell's bit position `column * (rows + 1) + row`. The positions of the unused
+    bit on top of each column hold an empty tuple.
+  """
+  lines_through = [[] for _ in range(columns * (rows + 1))]
+  for row in range(rows):
+    for column in range(columns):
+      for d_row, d_column in ((1, 0), (0, 1), (1, 1), (1, -1)):
+        cells = [(row + k * d_row, column + k * d_column) for k in range(4)]
+        if not all(0 <= r < rows and 0 <= c < columns for r, c in cells):
+          # Line runs off the board
+          continue
+        positions = [c * (rows + 1) + r for r, c in cells]
+        mask = 0
+        for position in positions:
+          mask |= 1 << position
+        for position in positions:
+          lines_through[position].append(mask)
+  return tuple(tuple(masks) for masks in lines_through)
+
+LINES_THROUGH = _winning_lines(ROWS, COLUMNS)
+LINES = tuple(sorted({line for lines in LINES_THROUGH for line in lines}))
 
 class Connect4Game:
   """Initializes a game of Connect 4.
@@ -27,12 +72,25 @@ class Connect4Game:
       ValueError: If the names of the two players are the same or if the passed 
                   names are either "Computer1" or "Computer2"
     """
+  __slots__ = ('players', 'scores', 'bb', 'heights', '_open_cols', 'move_count',
+               'hash', 'winner', 'current_player', 'current_player_index',
+               'game_over', '_tt', '_is_computer', '_zobrist')
+
+  COLUMNS = COLUMNS
+  ROWS = ROWS
+  SEARCH_TIME = 0.25
+  # Center columns take part in the most lines, so search them first
+  _move_order = sorted(range(COLUMNS),
+                       key=lambda column: abs(2 * column - COLUMNS + 1))
+
   def __init__(self, player1: Optional[str] = None, player2: Optional[str] = None):
     reserved_names = ["Computer1", "Computer2"]
     if player1 in reserved_names:
       raise ValueError("Attempted to use reserved name! Cannot use: " + player1)
     if player2 in reserved_names:
       raise ValueError("Attempted to use reserved name! Cannot use: " + player2)
+    # Only the players without a given name are computers
+    self._is_computer = (player1 is None, player2 is None)
     if player1 is None:
       player1 = "Computer1"
     if player2 is None:
@@ -43,14 +101,21 @@ class Connect4Game:
     # State initialization
     self.players = [player1, player2]
     self.scores = { player1: 0, player2: 0 }
-    self.board = None
+    self.bb = [0, 0]
+    self.heights = None
+    self._open_cols = []
+    self.move_count = 0
+    self.hash = 0
     self.winner = None
     self.current_player = None
     self.current_player_index = None
     self.game_over = False
+    self._tt = {}
 
-    self.COLUMNS = 7
-    self.ROWS = 6
+    # Seeded so that position keys agree between game instances
+    rng = random.Random(0)
+    self._zobrist = [[[rng.getrandbits(64) for _ in range(2)]
+                      for _ in range(self.COLUMNS)] for _ in range(self.ROWS)]
 
   def start_game(self) -> List[List[str]]:
     """ Start a new game of Connect 4.
@@ -64,12 +129,17 @@ class Connect4Game:
       Since it is a 2-D List, board[0][0] refers to the bottom-leftmost cell on
       the board.
     """
-    self.board = [[None] * self.COLUMNS for _ in range(self.ROWS)]
+    self.bb = [0, 0]
+    self.heights = [0] * self.COLUMNS
+    self._open_cols = list(range(self.COLUMNS))
+    self.move_count = 0
+    self.hash = 0
+    self._tt = {}
     self.current_player_index = random.randint(0, 1)
     self.current_player = self.players[self.current_player_index]
     self.game_over = False
     self.winner = None
-    return copy.deepcopy(self.board)
+    return self._render()
 
   def place_token(self, column: Optional[int] = None) -> List[List[str]]:
     """Place a token in the given column, for the current player.
@@ -104,130 +174,280 @@ class Connect4Game:
     player = self.current_player
     if self.is_current_player_computer():
       # Computer player
-      # Select random column
-      column = random.randint(0, self.COLUMNS - 1)
-      while not self.is_placement_valid(column):
-        column = random.randint(0, self.COLUMNS - 1)
-
-    # Find which row to place the token
-    row = -1
-    for i in range(self.ROWS):
-      if self.board[i][column] is None:
-        self.board[i][column] = player
-        row = i
-        break
+      column = self._choose_computer_move()
+
+    # Drop the token onto the top of the column
+    row = self.heights[column]
+    self.bb[self.current_player_index] |= 1 << (column * (self.ROWS + 1) + row)
+    self.heights[column] += 1
+    if self.heights[column] == self.ROWS:
+      self._open_cols.remove(column)
+    self.move_count += 1
+    self.hash ^= self._zobrist[row][column][self.current_player_index]
 
     if self.__check_win(row, column):
       # Check if token placement triggers a win.
       self.game_over = True
       self.winner = player
       self.scores[player] += 1
-    else:
-      # Check if game board is filled
-      filled = True
-      for i in range(self.ROWS):
-        for j in range(self.COLUMNS):
-          cell = self.board[i][j]
-          if cell is None:
-            filled = False
-            break
-        if not filled:
-          break
-      # If filled, game is over
-      if filled:
-        self.game_over = True
+    elif self.move_count >= self.ROWS * self.COLUMNS:
+      # If game board is filled, game is over
+      self.game_over = True
 
     self.current_player_index = (self.current_player_index + 1) % 2
     self.current_player = self.players[self.current_player_index]
 
-    return copy.deepcopy(self.board)
+    return self._render()
 
-  def __check_win(self, row: int, column: int) -> bool:
-    """Checks if a win has occurred in the given position.
+  def _render(self) -> List[List[str]]:
+    """Materialize the bitboards as a 2-dimensional List.
 
-    Checks the surrounding tiles to see if a Connect4 win has occured in the
-    given position. This method checks the horizontal, vertical, and diagonal
-    directions.
+    Each player's tokens are stored as one bit per cell, at bit
+    `column * (ROWS + 1) + row`. The extra bit on top of each column is always
+    empty so that shifted bitboards never wrap into the next column.
 
-    Args:
-      row: The row of the position to check.
-      column: The column of the position to check.
-    
     Returns:
-      bool: True if a win has occurred in the given position, False otherwise.
+      list: A new 2-dimensional List where each cell is the name of the player
+      who owns the token, or None if there is no token in that position.
     """
-    player = self.board[row][column]
-    if player is None:
-      return False
+    rows = self.ROWS
+    columns = self.COLUMNS
+    heights = self.heights
+    board = [[None] * columns for _ in range(rows)]
+    for index in (0, 1):
+      bitboard = self.bb[index]
+      player = self.players[index]
+      for column in range(columns):
+        for row in range(heights[column]):
+          if bitboard >> (column * (rows + 1) + row) & 1:
+            board[row][column] = player
+    return board
+
+  def _choose_computer_move(self) -> int:
+    """Choose a column for the current player with an alpha-beta search.
+
+    Searches for about SEARCH_TIME seconds and picks the column with the best
+    negamax value, preferring center columns on ties.
 
-    return (self.__has_vertical_win(row, column) or 
-      self.__has_horizontal_win(row, column) or
-      self.__has_diagonal_win(row, column))
+    Returns:
+      int: The column to place the token in.
+    """
+    return self._iterative_deepen(self.SEARCH_TIME)
 
-  def __has_vertical_win(self, row: int, column: int) -> bool:
-    """Check if a vertical win has occurred in the given position.
+  def _iterative_deepen(self, time_budget_s: float) -> int:
+    """Run successively deeper searches until the time budget is spent.
 
-    Checks the vertical direction for a win in the given position.
+    Each search starts from the previous best column, and the transposition
+    table keeps the best move found at every position, so the shallower
+    searches order the moves of the deeper ones. The depth in progress when the
+    budget runs out is always finished, so the budget may be exceeded.
 
     Args:
-      row: The row of the position to check.
-      column: The column of the position to check.
-    
+      time_budget_s: The number of seconds after which no deeper search starts.
+
     Returns:
-      bool: True if a win has occurred in the given position, False otherwise.
+      int: The best column found by the deepest completed search.
     """
-    player = self.board[row][column]
-    if player is None:
-      return False
-    
-    top = row
-    bottom = row
-    for i in range(row, self.ROWS):
-      if self.board[i][column] != player:
+    start = time.perf_counter()
+    cells = self.ROWS * self.COLUMNS
+    best_column = None
+    for depth in range(1, cells - self.move_count + 1):
+      best_column, score = self.__search_root(depth, best_column)
+      if abs(score) >= self.__win_score(cells):
+        # Forced win or loss, deeper searches cannot change the outcome
         break
-      top = max(top, i)
-    for i in range(row, -1, -1):
-      if self.board[i][column] != player:
+      if time.perf_counter() - start > time_budget_s:
         break
-      bottom = min(bottom, i)
-    if top - bottom + 1 >= 4:
-      # Vertical line of length >= 4
-      return True
+    return best_column
+
+  def __search_root(self, depth: int,
+                    first_column: Optional[int]) -> Tuple[int, int]:
+    """Search every column of the current position to the given depth.
 
-  def __has_horizontal_win(self, row: int, column: int) -> bool:
-    """Check if a vertical win has occurred in the given position.
+    Args:
+      depth: The number of moves to search.
+      first_column: The column to search first, or None for the default order.
 
-    Checks the vertical direction for a win in the given position.
+    Returns:
+      tuple: The best column and its negamax value for the current player.
+    """
+    index = self.current_player_index
+    heights = self.heights
+    rows = self.ROWS
+    alpha = -self.__win_score(0)
+    beta = self.__win_score(0)
+    best_column = None
+    for column in self.__ordered_moves(first_column):
+      if heights[column] >= rows:
+        continue
+      score = self.__search_move(column, index, depth, alpha, beta)
+      if best_column is None or score > alpha:
+        alpha = score
+        best_column = column
+    return best_column, alpha
+
+  def __ordered_moves(self, first_column: Optional[int]) -> List[int]:
+    """Get the order in which to search the columns.
 
     Args:
-      row: The row of the position to check.
-      column: The column of the position to check.
-    
+      first_column: The column to search first, or None for the default order.
+
     Returns:
-      bool: True if a win has occurred in the given position, False otherwise.
+      list: Every column, center-out, with the given column moved to the front.
     """
-    player = self.board[row][column]
-    if player is None:
-      return False
-    
-    left = column
-    right = column
-    for i in range(column, -1, -1):
-      if self.board[row][i] != player:
-        break
-      left = min(left, i)
-    for i in range(column, self.COLUMNS):
-      if self.board[row][i] != player:
+    if first_column is None:
+      return self._move_order
+    return [first_column] + [column for column in self._move_order
+                             if column != first_column]
+
+  def __search_move(self, column: int, index: int, depth: int, alpha: int,
+                    beta: int) -> int:
+    """Score placing a token in the given column for the given player.
+
+    The token is placed on the bitboards for the duration of the search and
+    removed again before returning.
+
+    Args:
+      column: The column to place the token in.
+      index: The index of the player placing the token.
+      depth: The number of moves to search, including this one.
+      alpha: The lowest score the player is already guaranteed.
+      beta: The highest score the opponent will allow.
+
+    Returns:
+      int: The value of the move from the point of view of the given player.
+    """
+    bb = self.bb
+    heights = self.heights
+    rows = self.ROWS
+    row = heights[column]
+    position = column * (rows + 1) + row
+    key = self._zobrist[row][column][index]
+    bitboard = bb[index] | 1 << position
+    bb[index] = bitboard
+    heights[column] = row + 1
+    move_count = self.move_count + 1
+    self.move_count = move_count
+    self.hash ^= key
+
+    if any(bitboard & line == line for line in LINES_THROUGH[position]):
+      score = self.__win_score(move_count)
+    elif move_count >= rows * self.COLUMNS:
+      score = 0
+    else:
+      score = -self.__negamax(1 - index, depth - 1, -beta, -alpha)
+
+    self.hash ^= key
+    self.move_count = move_count - 1
+    heights[column] = row
+    bb[index] = bitboard ^ 1 << position
+    return score
+
+  def __negamax(self, index: int, depth: int, alpha: int, beta: int) -> int:
+    """Compute the negamax value of the position for the player to move.
+
+    Uses alpha-beta pruning, with results stored in the transposition table
+    keyed by the position's Zobrist hash. Each entry also records the best
+    column found, which is searched first when the position is seen again.
+
+    Args:
+      index: The index of the player to move.
+      depth: The number of moves to search.
+      alpha: The lowest score the player is already guaranteed.
+      beta: The highest score the opponent will allow.
+
+    Returns:
+      int: The value of the position from the point of view of the given player.
+    """
+    if depth <= 0:
+      return self.__evaluate(index)
+
+    tt = self._tt
+    key = self.hash
+    entry = tt.get(key)
+    hint = None
+    if entry is not None:
+      hint = entry[3]
+    if entry is not None and entry[0] >= depth:
+      _, value, flag, _ = entry
+      if flag == EXACT:
+        return value
+      elif flag == LOWER_BOUND:
+        alpha = max(alpha, value)
+      else:
+        beta = min(beta, value)
+      if alpha >= beta:
+        return value
+
+    original_alpha = alpha
+    best = None
+    best_column = None
+    heights = self.heights
+    rows = self.ROWS
+    for column in self.__ordered_moves(hint):
+      if heights[column] >= rows:
+        continue
+      score = self.__search_move(column, index, depth, alpha, beta)
+      if best is None or score > best:
+        best = score
+        best_column = column
+      if best > alpha:
+        alpha = best
+      if alpha >= beta:
         break
-      right = max(right, i)
-    if right - left + 1 >= 4:
-      # Horizontal line of length >= 4
-      return True
 
-  def __has_diagonal_win(self, row: int, column: int) -> bool:
-    """Check if a diagonal win has occurred in the given position.
+    if best <= original_alpha:
+      flag = UPPER_BOUND
+    elif best >= beta:
+      flag = LOWER_BOUND
+    else:
+      flag = EXACT
+    tt[key] = (depth, best, flag, best_column)
+    return best
+
+  def __evaluate(self, index: int) -> int:
+    """Heuristically score the position for the given player.
+
+    Every line of four still open to only one player counts towards that
+    player, weighted by how many tokens they already have in it.
+
+    Args:
+      index: The index of the player to score the position for.
+
+    Returns:
+      int: The score of the position from the point of view of the given player.
+    """
+    own = self.bb[index]
+    other = self.bb[1 - index]
+    weights = LINE_WEIGHTS
+    score = 0
+    for line in LINES:
+      if not other & line:
+        score += weights[bin(own & line).count("1")]
+      elif not own & line:
+        score -= weights[bin(other & line).count("1")]
+    return score
+
+  def __win_score(self, move_count: int) -> int:
+    """Get the score of a win on the given move.
+
+    Wins are worth more than any heuristic score, and earlier wins are worth
+    more than later ones.
+
+    Args:
+      move_count: The number of tokens on the board after the winning move.
+
+    Returns:
+      int: The score of the win for the winning player.
+    """
+    return len(LINES) * LINE_WEIGHTS[-1] + self.ROWS * self.COLUMNS - move_count
 
-    Checks the diagonal directions for a win in the given position.
+  def __check_win(self, row: int, column: int) -> bool:
+    """Checks if a win has occurred in the given position.
+
+    Checks the precomputed lines of four through the given position to see if a
+    Connect4 win has occured there. This covers the horizontal, vertical, and
+    diagonal directions.
 
     Args:
       row: The row of the position to check.
@@ -236,62 +456,69 @@ class Connect4Game:
     Returns:
       bool: True if a win has occurred in the given position, False otherwise.
     """
-    player = self.board[row][column]
-    if player is None:
-      return False
-    
-    # Check top left to bottom right diagonal
-    top_left = (row, column)
-    bottom_right = (row, column)
-    while True:
-      new_row, new_column = top_left[0] - 1, top_left[1] - 1
-      if (new_row < 0 or new_row >= self.ROWS) or \
-        (new_column < 0 or new_column >= self.COLUMNS):
-        # Out of bounds
-        break
-      if self.board[new_row][new_column] != player:
-        break
-      top_left = (new_row, new_column)
-    while True:
-      new_row, new_column = bottom_right[0] + 1, bottom_right[1] + 1
-      if (new_row < 0 or new_row >= self.ROWS) or \
-        (new_column < 0 or new_column >= self.COLUMNS):
-        # Out of bounds
-        break
-      if self.board[new_row][new_column] != player:
-        break
-      bottom_right = (new_row, new_column)
-    if bottom_right[0] - top_left[0] + 1 >= 4:
-      # Top left to bottom right diagonal of length >= 4
-      return True
-    
-    # Check top right to bottom left diagonal
-    top_right = (row, column)
-    bottom_left = (row, column)
-    while True:
-      new_row, new_column = top_right[0] - 1, top_right[1] + 1
-      if (new_row < 0 or new_row >= self.ROWS) or \
-        (new_column < 0 or new_column >= self.COLUMNS):
-        # Out of bounds
-        break
-      if self.board[new_row][new_column] != player:
-        break
-      top_right = (new_row, new_column)
-    while True:
-      new_row, new_column = bottom_left[0] + 1, bottom_left[1] - 1
-      if (new_row < 0 or new_row >= self.ROWS) or \
-        (new_column < 0 or new_column >= self.COLUMNS):
-        # Out of bounds
-        break
-      if self.board[new_row][new_column] != player:
-        break
-      bottom_left = (new_row, new_column)
-    if bottom_left[0] - top_right[0] + 1 >= 4:
-      # Top right to bottom left diagonal of length >= 4
-      return True
-    
-    # No line of length 4 found
-    return False
+    position = column * (self.ROWS + 1) + row
+    bit = 1 << position
+    bitboard, other = self.bb
+    if not bitboard & bit:
+      if not other & bit:
+        return False
+      bitboard = other
+
+    # Only lines through the new token can have been completed by it
+    return any(bitboard & line == line
+               for line in LINES_THROUGH[position])
+
+  def simulate_random_playouts(self, n: int) -> Dict[str, int]:
+    """Play out the current game randomly a number of times.
+
+    Starting from the current position and the current player, each playout
+    places tokens in random columns until a player wins or the board is filled.
+    The game itself is left untouched, so this can be used to estimate how
+    promising a position is.
+
+    Args:
+      n: The number of playouts to run.
+
+    Returns:
+      dict: A dictionary with the names of each player as the keys and the number
+      of playouts they won as the values. Playouts ending in a tie are not
+      counted.
+
+    Raises:
+      RuntimeError: If the game has not been started or is already over.
+    """
+    if self.heights is None:
+      raise RuntimeError("Game has not started")
+    if self.is_game_over():
+      raise RuntimeError("Game is over")
+
+    rows = self.ROWS
+    columns = self.COLUMNS
+    cells = rows * columns
+    lines_through = LINES_THROUGH
+    choice = random.choice
+    wins = [0, 0]
+    for _ in range(n):
+      bb = list(self.bb)
+      heights = list(self.heights)
+      open_cols = list(self._open_cols)
+      index = self.current_player_index
+      move_count = self.move_count
+      while move_count < cells:
+        column = choice(open_cols)
+        row = heights[column]
+        heights[column] = row + 1
+        if row + 1 == rows:
+          open_cols.remove(column)
+        position = column * (rows + 1) + row
+        bitboard = bb[index] | 1 << position
+        bb[index] = bitboard
+        move_count += 1
+        if any(bitboard & line == line for line in lines_through[position]):
+          wins[index] += 1
+          break
+        index ^= 1
+    return { self.players[0]: wins[0], self.players[1]: wins[1] }
 
   def get_scores(self) -> Dict[str, int]:
     """ Get the scores of the players.
@@ -303,7 +530,7 @@ class Connect4Game:
       dict: A dictionary with the names of each player as the keys and the scores as
       the values.
     """
-    return copy.deepcopy(self.scores)
+    return dict(self.scores)
     
 
   def get_winner(self) -> str: 
@@ -331,10 +558,10 @@ class Connect4Game:
     Returns:
       bool: True if the player on move is a computer, False otherwise. 
     """
-    if (self.current_player == 'Computer1' or
-        self.current_player == 'Computer2'):
-        return True
-    return False 
+    if self.current_player_index is None:
+      # Game has not started
+      return False
+    return self._is_computer[self.current_player_index]
 
   def get_player_names(self) -> list:
     """ Get the name of the players. 
@@ -344,7 +571,17 @@ class Connect4Game:
     Returns:
       list: The names of the players.
     """
-    return copy.deepcopy(self.players)
+    return list(self.players)
+
+  def get_position_key(self) -> int:
+    """ Get a hash key for the current position.
+    The key is a Zobrist hash of the tokens on the board, updated with every
+    placement, so equal positions reached by different move orders share a key.
+
+    Returns:
+      int: A 64-bit key identifying the current board position.
+    """
+    return self.hash
 
   def is_game_over(self) -> bool:
     """ Check if the game has ended. 
@@ -368,10 +605,5 @@ class Connect4Game:
       bool: True if the move is valid, False otherwise.
 
     """
-    if self.board != None and column != None: 
-      if column < 0 or column >= self.COLUMNS:
-        return False
-      for i in range(self.ROWS - 1, -1, -1):
-        if self.board[i][column] is None:
-          return True
-    return False
+    return (self.heights is not None and column is not None and
+            0 <= column < self.COLUMNS and self.heights[column] < self.ROWS)